@@ -1,18 +1,31 @@
 import io
 import re
 import json
+import hashlib
 import os
+import sys
+from collections import Counter
+from itertools import islice
+from operator import itemgetter
 import openpyxl
 from openpyxl import Workbook
 import xlrd
 import streamlit as st
 
+from network_xlsx import NETWORK_OUT_HEADERS, make_network_xlsx
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Config
 # ─────────────────────────────────────────────────────────────────────────────
 SCRIPT_DIR     = os.path.dirname(os.path.abspath(__file__))
 TEMPLATES_FILE = os.path.join(SCRIPT_DIR, "templates.json")
 
+# Sheet / header / format detection only looks at the first rows of a sheet
+HEAD_ROWS = 30
+
+# Saved templates are listed this many expanders per page in the Templates tab
+TEMPLATES_PER_PAGE = 20
+
 OUT_HEADERS = [
     "Item ID", "Item Name", "Product/Service",
     "Item Type (Buy/Sell/Both)", "Unit of Measurement", "HSN Code",
@@ -26,6 +39,7 @@ TARGET_COLS = [
     "Item Name", "Item ID", "HSN Code",
     "Item Category", "Unit of Measurement", "Tax", "Product/Service"
 ]
+_TARGET_BY_LOWER = {t.lower(): t for t in TARGET_COLS}
 
 # Weighted keywords: (keyword, weight) — higher weight = stronger signal
 WEIGHTED_KEYWORDS = {
@@ -47,6 +61,8 @@ SYSTEM_COLS = {
 }
 
 ILLEGAL_RE = re.compile(r'[\x00-\x08\x0b-\x0c\x0e-\x1f]')
+# Same character set as ILLEGAL_RE, as a str.translate() deletion table
+_ILLEGAL_TRANS = dict.fromkeys([*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20)])
 
 # Values that identify a column as "Item Category" regardless of column name.
 # All entries are pre-normalised (lowercase, no spaces/underscores/hyphens).
@@ -74,15 +90,35 @@ CATEGORY_NORM_TOKENS = {
 def clean(v):
     return ILLEGAL_RE.sub('', v).strip() if isinstance(v, str) else v
 
+# cache_data lives outside the script module, so it survives full reruns, and
+# hands each caller its own unpickled copy to add to / delete from
+@st.cache_data(show_spinner=False, max_entries=1)
+def _read_templates(stamp):
+    """Parse templates.json; `stamp` is its (mtime_ns, size), so a save invalidates."""
+    with open(TEMPLATES_FILE) as f:
+        return json.load(f)
+
 def load_templates():
-    if os.path.exists(TEMPLATES_FILE):
-        with open(TEMPLATES_FILE) as f:
-            return json.load(f)
-    return {}
+    try:
+        info = os.stat(TEMPLATES_FILE)
+    except FileNotFoundError:
+        return {}
+    templates = _read_templates((info.st_mtime_ns, info.st_size))
+    # Intern fingerprints to match the interned headers from detect_header
+    # (unpickled copies come back un-interned)
+    for tmpl in templates.values():
+        if "fingerprint" in tmpl:
+            tmpl["fingerprint"] = [sys.intern(h) for h in tmpl["fingerprint"]]
+    return templates
 
 def save_templates(data):
     with open(TEMPLATES_FILE, 'w') as f:
         json.dump(data, f, indent=2)
+    # A same-size rewrite within one mtime tick would keep the old stamp; the
+    # stamp only has to catch edits made outside the app
+    _read_templates.clear()
+
+_ZERO_PAD_RE = re.compile(r'^0+$')
 
 def _fmt_cell(val, fmt):
     """
@@ -92,40 +128,51 @@ def _fmt_cell(val, fmt):
     if not isinstance(val, (int, float)) or not fmt:
         return val
     # Pure zero-padding format: only '0' digits, no decimal or special chars
-    if re.match(r'^0+$', fmt):
+    if _ZERO_PAD_RE.match(fmt):
         return str(int(val)).zfill(len(fmt))
     return val
 
+XLSX_MAGIC = b'PK\x03\x04'          # zip container (xlsx)
+XLS_MAGIC  = b'\xd0\xcf\x11\xe0'      # OLE2 compound file (xls)
+
+def sniff(file_bytes):
+    """Return "xlsx", "xls" or "csv" from the file's magic bytes."""
+    head = file_bytes[:4]
+    if head == XLSX_MAGIC:
+        return "xlsx"
+    if head == XLS_MAGIC:
+        return "xls"
+    return "csv"
+
 def read_file(file_bytes):
-    """Read all sheets from xls, xlsx, or csv. Returns {sheet_name: [[row_values]]}"""
-    is_xls  = file_bytes[:4] == b'\xd0\xcf\x11\xe0'
-    is_xlsx = file_bytes[:4] == b'PK\x03\x04'
+    """
+    Read all sheets from xls, xlsx, or csv. Returns {sheet_name: [[row_values]]}
+    Blank rows come back as [] (emptiness is decided while the row is read),
+    so callers can skip them with a plain `if not row`.
+    """
+    kind   = sniff(file_bytes)
     sheets = {}
-    if not is_xls and not is_xlsx:
+    if kind == "csv":
         # Treat as CSV
-        import csv as _csv
         try:
-            text = file_bytes.decode('utf-8-sig')
+            rows = _read_csv_rows(file_bytes, 'utf-8-sig')
         except UnicodeDecodeError:
-            text = file_bytes.decode('latin-1')
-        reader = _csv.reader(io.StringIO(text))
-        rows = []
-        for row in reader:
-            rows.append([cell.strip() if cell.strip() else None for cell in row])
+            rows = _read_csv_rows(file_bytes, 'latin-1')
         return {"Sheet1": rows}
-    if is_xls:
+    if kind == "xls":
         wb = xlrd.open_workbook(file_contents=file_bytes, formatting_info=True)
         xf_list   = wb.xf_list
         fmt_map   = wb.format_map
         for ws in wb.sheets():
             rows = []
             for r in range(ws.nrows):
-                row = []
+                row, filled = [], False
                 for c in range(ws.ncols):
                     cell = ws.cell(r, c)
                     if cell.ctype == xlrd.XL_CELL_EMPTY:
                         row.append(None)
                     elif cell.ctype == xlrd.XL_CELL_NUMBER:
+                        filled = True
                         v = cell.value
                         num = int(v) if v == int(v) else v
                         # Try to apply leading-zero format from xf record
@@ -138,53 +185,118 @@ def read_file(file_bytes):
                         row.append(num)
                     else:
                         v = str(cell.value).strip()
+                        filled = filled or bool(v)
                         row.append(v or None)
-                rows.append(row)
+                rows.append(row if filled else [])
             sheets[ws.name] = rows
     else:
-        wb = openpyxl.load_workbook(io.BytesIO(file_bytes))
+        wb = openpyxl.load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True,
+                                    keep_links=False)
         for ws in wb.worksheets:
-            sheet_rows = []
-            for row in ws.iter_rows():
-                row_data = []
-                for cell in row:
-                    val = cell.value
-                    if val is not None:
-                        val = _fmt_cell(val, cell.number_format)
-                    row_data.append(val)
-                sheet_rows.append(row_data)
-            sheets[ws.title] = sheet_rows
+            sheets[ws.title] = _xlsx_sheet_rows(ws)
+        wb.close()
     return sheets
 
+def _read_csv_rows(file_bytes, encoding):
+    """
+    Decode and parse CSV incrementally: a TextIOWrapper over the upload's
+    buffer avoids holding a decoded copy of the whole file (which StringIO
+    would widen to 4 bytes per char) next to the original bytes.
+    """
+    import csv as _csv
+    reader = _csv.reader(io.TextIOWrapper(io.BytesIO(file_bytes), encoding=encoding,
+                                          newline=""))
+    rows = []
+    for row in reader:
+        cells = [cell.strip() or None for cell in row]
+        rows.append(cells if any(c is not None for c in cells) else [])
+    return rows
+
+def file_digest(file_bytes):
+    """Short content hash of an upload, used as the cache key for parsed results."""
+    return hashlib.blake2b(file_bytes, digest_size=8).hexdigest()
+
+# Streamlit reruns the script on every widget change; these wrappers turn a
+# repeat parse of the same bytes into a cache hit. Underscored arguments are
+# not hashed — the digest stands in for them. cache_resource hands back the
+# shared object instead of unpickling a copy of a whole workbook per hit, so
+# callers treat results as read-only; entries are few and expire after an hour.
+@st.cache_resource(show_spinner=False, max_entries=4, ttl="1h")
+def _cached_read_file(digest, _file_bytes):
+    return read_file(_file_bytes)
+
+@st.cache_resource(show_spinner=False, max_entries=4, ttl="1h")
+def _cached_parse_tally_bom(digest, _file_bytes):
+    return parse_tally_bom(_file_bytes)
+
+@st.cache_resource(show_spinner=False, max_entries=4, ttl="1h")
+def _cached_do_convert(digest, header_idx, mapping_items, extra_cols, _rows):
+    return do_convert(_rows, header_idx, dict(mapping_items), list(extra_cols))
+
+def _xlsx_sheet_rows(ws):
+    """Read a read-only openpyxl worksheet into [[row_values]]."""
+    # Some exporters write a wrong <dimension>; read every row actually stored
+    ws.reset_dimensions()
+    sheet_rows = []
+    for row in ws.iter_rows():
+        row_data, filled = [], False
+        for cell in row:
+            val = cell.value
+            # Only numbers can carry a zero-padding format — skip the style
+            # lookup for text, dates and empty cells
+            if isinstance(val, (int, float)):
+                val = _fmt_cell(val, cell.number_format)
+                filled = True
+            elif val is not None and not filled:
+                filled = not isinstance(val, str) or bool(val.strip())
+            row_data.append(val)
+        sheet_rows.append(row_data if filled else [])
+    return sheet_rows
+
+def _norm_cell(v):
+    if v is None:
+        return None
+    return (v if isinstance(v, str) else str(v)).strip().lower() or None
+
+def normalize_head(rows):
+    """
+    Lower-cased, stripped view of the first HEAD_ROWS rows — the window the
+    sheet / header / format detectors look at. Cell-aligned with rows; blank
+    cells become None. Build it once per sheet and pass it to each detector.
+    """
+    return [[_norm_cell(v) for v in row] for row in rows[:HEAD_ROWS]]
+
 def pick_sheet(sheets):
     """Return the sheet with the most populated rows."""
-    return max(sheets, key=lambda s: sum(
-        1 for r in sheets[s]
-        if any(v is not None and str(v).strip() for v in r)
-    ))
+    return max(sheets, key=lambda s: sum(1 for r in sheets[s] if r))
+
+# Item master header signatures, matched as substrings of any header cell.
+# Cells are joined with "\n", which no keyword contains, so a hit never
+# straddles two cells.
+_HSN_SIG_RE = re.compile(r"hsn|sac")
+_UOM_SIG_RE = re.compile(r"unit|uom|measure")
+_TAX_SIG_RE = re.compile(r"tax|gst")         # "gst" also covers "igst"
 
-def pick_item_master_sheet(sheets):
+def pick_item_master_sheet(sheets, heads=None):
     """
     Return the sheet whose header row contains HSN, UOM/Unit, AND Tax columns.
     Falls back to pick_sheet() if no such sheet is found.
+    heads: optional {sheet_name: normalize_head(rows)} to reuse.
     """
-    HSN_KWS = {"hsn", "sac"}
-    UOM_KWS = {"unit", "uom", "measure"}
-    TAX_KWS = {"tax", "gst", "igst"}
     for name, rows in sheets.items():
-        for row in rows[:20]:
-            vals = [str(v).strip().lower() for v in row if v is not None and str(v).strip()]
-            has_hsn = any(any(kw in v for kw in HSN_KWS) for v in vals)
-            has_uom = any(any(kw in v for kw in UOM_KWS) for v in vals)
-            has_tax = any(any(kw in v for kw in TAX_KWS) for v in vals)
-            if has_hsn and has_uom and has_tax:
+        head = heads[name] if heads else normalize_head(rows)
+        for nrow in head[:20]:
+            joined = "\n".join(v for v in nrow if v)
+            if (_HSN_SIG_RE.search(joined) and _UOM_SIG_RE.search(joined)
+                    and _TAX_SIG_RE.search(joined)):
                 return name
     return pick_sheet(sheets)
 
-def detect_header(rows):
+def detect_header(rows, head=None):
     """
     Scan first 30 rows to find the header row.
     Scores by: number of string cells + keyword hits × 2.
+    head: optional normalize_head(rows) to reuse.
     """
     HWORDS = {
         "name", "item", "product", "hsn", "unit", "uom", "category", "group",
@@ -192,17 +304,20 @@ def detect_header(rows):
         "quantity", "serial", "service", "rate", "no", "sno", "sr", "brand",
         "barcode", "rack", "sac", "measure", "sku"
     }
+    if head is None:
+        head = normalize_head(rows)
     best_i, best_s = 0, -1
-    for i, row in enumerate(rows[:30]):
-        non_null = [v for v in row if v is not None and str(v).strip()]
+    for i, (row, nrow) in enumerate(zip(rows, head)):
+        non_null = [(v, nv) for v, nv in zip(row, nrow) if nv]
         if len(non_null) < 2:
             continue
-        strings  = sum(1 for v in non_null if isinstance(v, str))
-        keywords = sum(1 for v in non_null if any(w in str(v).lower() for w in HWORDS))
+        strings  = sum(1 for v, _ in non_null if isinstance(v, str))
+        keywords = sum(1 for _, nv in non_null if any(w in nv for w in HWORDS))
         score = strings + keywords * 2
         if score > best_s:
             best_s, best_i = score, i
-    return best_i, [str(v).strip() if v is not None else None for v in rows[best_i]]
+    # Interned so later dict / set lookups keyed by header hit the identity fast path
+    return best_i, [sys.intern(str(v).strip()) if v is not None else None for v in rows[best_i]]
 
 def is_system_col(h):
     """Return True if column is a UI/system column that should be skipped."""
@@ -239,11 +354,12 @@ def detect_category_by_values(headers, data_rows, skip_cols):
             continue
 
         # Count how many unique values match category tokens (normalised)
-        hits = sum(
-            1 for v in unique_vals
-            if _norm(v) in CATEGORY_NORM_TOKENS
-            or any(tok in _norm(v) for tok in CATEGORY_NORM_TOKENS if len(tok) > 3)
-        )
+        hits = 0
+        for v in unique_vals:
+            nv = _norm(v)
+            if nv in CATEGORY_NORM_TOKENS or any(
+                    tok in nv for tok in CATEGORY_NORM_TOKENS if len(tok) > 3):
+                hits += 1
         ratio = hits / len(unique_vals)
         if ratio >= 0.4 and ratio > best_score:
             best_score, best_col = ratio, h
@@ -271,11 +387,10 @@ def auto_map(headers, data_rows):
     for h in headers:
         if not h:
             continue
-        for t in TARGET_COLS:
-            if t not in used and h.lower() == t.lower():
-                result[t] = h
-                used.add(t)
-                break
+        t = _TARGET_BY_LOWER.get(h.lower())
+        if t and t not in used:
+            result[t] = h
+            used.add(t)
 
     # ── Pass 2: category detection by column VALUES ──────────────────────
     if "Item Category" not in result:
@@ -377,33 +492,41 @@ def find_template(headers, templates):
         return best_name, templates[best_name]
     return None, None
 
+def _cell_str(row, i):
+    """Cleaned string value of row[i]; None when i is unmapped, out of range or blank."""
+    if i is None or i >= len(row):
+        return None
+    v = row[i]
+    if v is None:
+        return None
+    s = v if isinstance(v, str) else str(v)
+    return clean(s) if s.strip() else None
+
 def do_convert(rows, header_idx, mapping, extra_cols):
     """Convert rows to Product_Add format, appending extra columns at end."""
     hdrs = [str(v).strip() if v is not None else None for v in rows[header_idx]]
     col  = {h: i for i, h in enumerate(hdrs) if h}
     tidx = {t: col[c] for t, c in mapping.items() if c and c in col}
-    eidx = [(h, col[h]) for h in extra_cols if h in col]
+    eidx = [col[h] for h in extra_cols if h in col]
+
+    # Row positions of each target column, resolved once for the whole sheet
+    name_i, id_i, ps_i = tidx.get("Item Name"), tidx.get("Item ID"), tidx.get("Product/Service")
+    uom_i, hsn_i       = tidx.get("Unit of Measurement"), tidx.get("HSN Code")
+    cat_i, tax_i       = tidx.get("Item Category"), tidx.get("Tax")
 
     out = []
     for row in rows[header_idx + 1:]:
-        if not row or all(v is None or str(v).strip() == "" for v in row):
+        if not row:   # blank rows are [] from read_file
             continue
 
-        def g(t):
-            i = tidx.get(t)
-            if i is None or i >= len(row):
-                return None
-            v = row[i]
-            return clean(str(v)) if (v is not None and str(v).strip()) else None
-
-        name = g("Item Name")
+        name = _cell_str(row, name_i)
         if not name:
             continue
 
-        ps    = g("Product/Service")
+        ps    = _cell_str(row, ps_i)
         ps_out = "Service" if (ps and "service" in ps.lower()) else "Product"
 
-        tax = g("Tax")
+        tax = _cell_str(row, tax_i)
         if not tax or tax == "0":
             tax_out = None
         else:
@@ -413,15 +536,14 @@ def do_convert(rows, header_idx, mapping, extra_cols):
                 tax_out = None
 
         row_out = [
-            g("Item ID"), name, ps_out, "Both",
-            g("Unit of Measurement") or "", g("HSN Code"),
-            g("Item Category") or "",
+            _cell_str(row, id_i), name, ps_out, "Both",
+            _cell_str(row, uom_i) or "", _cell_str(row, hsn_i),
+            _cell_str(row, cat_i) or "",
             None, None, None, None, None, None, None,
             None, None, None, tax_out
         ]
-        for _, ei in eidx:
-            v = row[ei] if ei < len(row) else None
-            row_out.append(clean(str(v)) if (v is not None and str(v).strip()) else None)
+        for ei in eidx:
+            row_out.append(_cell_str(row, ei))
         out.append(row_out)
     return out
 
@@ -445,21 +567,21 @@ def out_filename(fname):
 # Network Master helpers
 # ─────────────────────────────────────────────────────────────────────────────
 
-NETWORK_OUT_HEADERS = [
-    "Company Name", "Buyer/Supplier/Both", "Company Reference ID",
-    "TCS Type", "Company Email", "Company Contact Number",
-    "Address Line 1", "Address Line 2", "City", "State", "Country",
-    "PIN Code", "GSTIN", "GSTIN Type",
-    "Contact Person First Name", "Contact Person Last Name", "Contact Person Email"
-]
-
-@st.cache_data(show_spinner=False)
+@st.cache_resource(show_spinner=False)
 def load_pincode_db():
+    # Shared read-only table: cache_resource skips the per-call deep copy that
+    # cache_data makes of ~19k entries. Keys are padded to 6 digits once here
+    # and the repeated city/state strings are interned.
     path = os.path.join(SCRIPT_DIR, "pincode_db.json")
-    if os.path.exists(path):
-        with open(path) as f:
-            return json.load(f)
-    return {}
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        raw = json.load(f)
+    return {
+        str(pin).zfill(6): {k: sys.intern(v) if isinstance(v, str) else v
+                            for k, v in entry.items()}
+        for pin, entry in raw.items()
+    }
 
 GSTIN_STATE_MAP = {
     "01":"Jammu & Kashmir","02":"Himachal Pradesh","03":"Punjab","04":"Chandigarh",
@@ -474,9 +596,8 @@ GSTIN_STATE_MAP = {
 }
 
 def state_from_gstin(gstin):
-    if gstin and len(gstin) >= 2:
-        return GSTIN_STATE_MAP.get(gstin[:2].zfill(2))
-    return None
+    # The 2-char prefix is already the map key; no padding or caching needed
+    return GSTIN_STATE_MAP.get(gstin[:2]) if gstin else None
 
 def clean_gstin(v):
     if not v:
@@ -573,6 +694,9 @@ STATE_ABBR_TO_NAME = {
     "LD": "Lakshadweep",      "PY": "Puducherry",
 }
 
+# "...City KA- 560002" — state abbreviation, dash, 6-digit PIN at the very end
+_STATE_PIN_RE = re.compile(r'\b([A-Z]{2})\s*[-\u2013]\s*(\d{6})\s*$')
+
 def parse_combined_address(addr_str):
     """
     Parse a combined address like:
@@ -588,7 +712,8 @@ def parse_combined_address(addr_str):
         return None, None, None, None, None
 
     s = addr_str.strip()
-    m = re.search(r'\b([A-Z]{2})\s*[-\u2013]\s*(\d{6})\s*$', s)
+    # Cheap probe first: the pattern needs at least "KA-560002" and a final digit
+    m = _STATE_PIN_RE.search(s) if len(s) >= 9 and s[-1].isdigit() else None
     if m:
         abbr    = m.group(1)
         pincode = m.group(2)
@@ -615,14 +740,14 @@ def parse_combined_address(addr_str):
     # Fallback: try comma-separated format
     return parse_mshriy_address(addr_str)
 
-def _tally_detect_sheet(sheets):
+def _tally_detect_sheet(sheets, heads=None):
     """Pick the SVNaturalLanguage sheet from Tally exports, else most populated."""
     if "SVNaturalLanguage" in sheets:
         return "SVNaturalLanguage"
     for name, rows in sheets.items():
-        for row in rows[:5]:
-            vals = [str(v).lower() for v in row if v]
-            if any("$name" in v for v in vals):
+        head = heads[name] if heads else normalize_head(rows)
+        for nrow in head[:5]:
+            if "$name" in "\n".join(v for v in nrow if v):
                 return name
     return pick_sheet(sheets)
 
@@ -633,23 +758,27 @@ ITEM_MASTER_SIGNALS = {
     "regular selling price", "regular buying price",
 }
 
-def is_item_master_sheet(rows):
+def is_item_master_sheet(rows, head=None):
     """Returns (True, matched_signals) if this individual sheet looks like an Item Master."""
-    for row in rows[:15]:
-        vals = {str(v).strip().lower() for v in row if v is not None and str(v).strip()}
+    if head is None:
+        head = normalize_head(rows)
+    for nrow in head[:15]:
+        vals = {v for v in nrow if v}
         matched = vals & ITEM_MASTER_SIGNALS
         if len(matched) >= 2:
             return True, matched
     return False, set()
 
-def detect_network_format(rows):
+def detect_network_format(rows, head=None):
     """
     Returns ('tally', header_idx) or ('mshriy', header_idx) or
             ('generic', header_idx) or ('unknown', 0).
     Generic: single combined ADDRESS column + GSTIN + vendor/party name col.
     """
-    for i, row in enumerate(rows[:15]):
-        vals   = [str(v).strip().lower() for v in row if v is not None and str(v).strip()]
+    if head is None:
+        head = normalize_head(rows)
+    for i, nrow in enumerate(head[:15]):
+        vals   = [v for v in nrow if v]
         joined = " ".join(vals)
         if "$name" in joined or "$_primarygroup" in joined:
             return "tally", i
@@ -663,31 +792,44 @@ def detect_network_format(rows):
             return "generic", i
     return "unknown", 0
 
-def _g(row, col_map, *keys):
-    """Get first non-empty value from row by column name keys."""
-    for k in keys:
-        i = col_map.get(k)
-        if i is not None and i < len(row):
+# Cell values treated as empty by the party converters
+_NULL_VALUES = frozenset({"none", "0.00", "0"})
+
+def _idxs(col_map, *keys):
+    """Resolve column name keys to row indices once, ahead of the row loop."""
+    return [col_map[k] for k in keys if k in col_map]
+
+def _first(row, idxs):
+    """Get first non-empty cleaned value from row at the pre-resolved indices."""
+    n = len(row)
+    for i in idxs:
+        if i < n:
             v = row[i]
             if v is not None:
-                s = clean(str(v))
-                if s and s.lower() not in ("none", "0.00", "0"):
+                s = (v if isinstance(v, str) else str(v)).translate(_ILLEGAL_TRANS).strip()
+                if s and s.lower() not in _NULL_VALUES:
                     return s
     return None
 
 def convert_tally_parties(rows, header_idx):
     hdrs = [str(v).strip() if v is not None else "" for v in rows[header_idx]]
     col  = {h: i for i, h in enumerate(hdrs)}
+    name_i,  group_i   = _idxs(col, "$Name"), _idxs(col, "$_PrimaryGroup")
+    addr1_i, addr2_i   = _idxs(col, "$_Address1"), _idxs(col, "$_Address2")
+    addr3_i, state_i   = _idxs(col, "$_Address3"), _idxs(col, "$PriorStateName")
+    country_i, pin_i   = _idxs(col, "$CountryName"), _idxs(col, "$pincode", "$Pincode")
+    gstin_i, mobile_i  = _idxs(col, "$_PartyGSTIN", "$PartyGSTIN"), _idxs(col, "$LedgerMobile")
+    email_i, contact_i = _idxs(col, "$email", "$Email"), _idxs(col, "$LedgerContact")
     parties = []
 
     for row in rows[header_idx + 1:]:
-        if not row or all(v is None or str(v).strip() == "" for v in row):
+        if not row:   # blank rows are [] from read_file
             continue
-        name = _g(row, col, "$Name")
+        name = _first(row, name_i)
         if not name:
             continue
 
-        group   = _g(row, col, "$_PrimaryGroup") or ""
+        group   = _first(row, group_i) or ""
         group_l = group.lower()
         if "sundry debtor" in group_l:
             party_type, is_red = "Buyer", False
@@ -696,17 +838,17 @@ def convert_tally_parties(rows, header_idx):
         else:
             party_type, is_red = group, True
 
-        addr1  = _g(row, col, "$_Address1")
-        addr2  = _g(row, col, "$_Address2")
-        addr3  = _g(row, col, "$_Address3")
+        addr1  = _first(row, addr1_i)
+        addr2  = _first(row, addr2_i)
+        addr3  = _first(row, addr3_i)
         addr2  = (addr2 + ", " + addr3) if addr2 and addr3 else (addr2 or addr3)
-        state  = _g(row, col, "$PriorStateName")
-        country= _g(row, col, "$CountryName") or "India"
-        pin    = clean_pin(_g(row, col, "$pincode", "$Pincode"))
-        gstin  = clean_gstin(_g(row, col, "$_PartyGSTIN", "$PartyGSTIN"))
-        mobile = _g(row, col, "$LedgerMobile")
-        email  = _g(row, col, "$email", "$Email")
-        fname, lname = split_name(_g(row, col, "$LedgerContact"))
+        state  = _first(row, state_i)
+        country= _first(row, country_i) or "India"
+        pin    = clean_pin(_first(row, pin_i))
+        gstin  = clean_gstin(_first(row, gstin_i))
+        mobile = _first(row, mobile_i)
+        email  = _first(row, email_i)
+        fname, lname = split_name(_first(row, contact_i))
 
         # Fill state from GSTIN if still missing
         if not state and gstin:
@@ -732,16 +874,22 @@ def convert_tally_parties(rows, header_idx):
 def convert_mshriy_parties(rows, header_idx):
     hdrs = [str(v).strip() if v is not None else "" for v in rows[header_idx]]
     col  = {h: i for i, h in enumerate(hdrs)}
+    name_i,  group_i = _idxs(col, "Name of Ledger"), _idxs(col, "Under")
+    addr_i,  state_i = _idxs(col, "Address"), _idxs(col, "State Name")
+    pin_i   = _idxs(col, "Pincode", "PIN", "Pin Code")
+    gstin_i = _idxs(col, "GSTIN/UIN", "GSTIN")
+    email_i = _idxs(col, "Mail ID", "Email")
+    mobile_i= _idxs(col, "Contact No.", "Mobile", "Phone")
     parties = []
 
     for row in rows[header_idx + 1:]:
-        if not row or all(v is None or str(v).strip() == "" for v in row):
+        if not row:   # blank rows are [] from read_file
             continue
-        name = _g(row, col, "Name of Ledger")
+        name = _first(row, name_i)
         if not name:
             continue
 
-        group   = _g(row, col, "Under") or ""
+        group   = _first(row, group_i) or ""
         group_l = group.lower()
         if "sundry debtor" in group_l:
             party_type, is_red = "Buyer", False
@@ -750,13 +898,13 @@ def convert_mshriy_parties(rows, header_idx):
         else:
             party_type, is_red = group, True
 
-        addr_raw              = _g(row, col, "Address")
+        addr_raw              = _first(row, addr_i)
         addr1, addr2, city, state_p, pin_p = parse_mshriy_address(addr_raw)
-        state  = _g(row, col, "State Name") or state_p
-        pin    = clean_pin(_g(row, col, "Pincode", "PIN", "Pin Code")) or clean_pin(pin_p)
-        gstin  = clean_gstin(_g(row, col, "GSTIN/UIN", "GSTIN"))
-        email  = _g(row, col, "Mail ID", "Email")
-        mobile = _g(row, col, "Contact No.", "Mobile", "Phone")
+        state  = _first(row, state_i) or state_p
+        pin    = clean_pin(_first(row, pin_i)) or clean_pin(pin_p)
+        gstin  = clean_gstin(_first(row, gstin_i))
+        email  = _first(row, email_i)
+        mobile = _first(row, mobile_i)
 
         # Fill state from GSTIN if missing
         if not state and gstin:
@@ -778,6 +926,15 @@ def convert_mshriy_parties(rows, header_idx):
         })
     return parties
 
+# Header substrings that identify each column of the generic party format
+GENERIC_COL_ROLES = (
+    ("name",    ("vendor", "party", "supplier", "buyer", "customer", "name")),
+    ("address", ("address",)),
+    ("gstin",   ("gstin",)),
+    ("email",   ("mail",)),                       # matches "email" too
+    ("mobile",  ("mobile", "phone", "contact")),
+)
+
 def convert_generic_parties(rows, header_idx):
     """
     Convert generic combined-address format (e.g. Tranzact):
@@ -786,41 +943,38 @@ def convert_generic_parties(rows, header_idx):
     hdrs = [str(v).strip() if v is not None else "" for v in rows[header_idx]]
     col  = {h: i for i, h in enumerate(hdrs)}
 
-    # Auto-detect column names
-    name_col = addr_col = gstin_col = email_col = mobile_col = None
+    # Auto-detect column names: each role takes the first header containing
+    # one of its tokens (one header may fill several roles)
+    found = {}
     for h in hdrs:
         hl = h.strip().lower()
-        if any(kw in hl for kw in ("vendor", "party", "supplier", "buyer", "customer")):
-            if name_col is None:
-                name_col = h
-        elif "name" in hl and name_col is None:
-            name_col = h
-        if "address" in hl and addr_col is None:
-            addr_col = h
-        if "gstin" in hl and gstin_col is None:
-            gstin_col = h
-        if ("email" in hl or "mail" in hl) and email_col is None:
-            email_col = h
-        if any(kw in hl for kw in ("mobile", "phone", "contact")) and mobile_col is None:
-            mobile_col = h
+        for role, tokens in GENERIC_COL_ROLES:
+            if role not in found and any(tok in hl for tok in tokens):
+                found[role] = h
+        if len(found) == len(GENERIC_COL_ROLES):
+            break
+
+    name_i,  addr_i   = _idxs(col, found.get("name")), _idxs(col, found.get("address"))
+    gstin_i, email_i  = _idxs(col, found.get("gstin")), _idxs(col, found.get("email"))
+    mobile_i          = _idxs(col, found.get("mobile"))
 
     parties = []
     for row in rows[header_idx + 1:]:
-        if not row or all(v is None or str(v).strip() == "" for v in row):
+        if not row:   # blank rows are [] from read_file
             continue
-        name = _g(row, col, name_col) if name_col else None
+        name = _first(row, name_i)
         if not name:
             continue
 
-        addr_raw = _g(row, col, addr_col) if addr_col else None
+        addr_raw = _first(row, addr_i)
         addr1, addr2, city, state, pin_parsed = (
             parse_combined_address(addr_raw) if addr_raw else (None, None, None, None, None)
         )
 
-        gstin  = clean_gstin(_g(row, col, gstin_col)) if gstin_col else None
+        gstin  = clean_gstin(_first(row, gstin_i))
         pin    = clean_pin(pin_parsed)
-        email  = _g(row, col, email_col)  if email_col  else None
-        mobile = _g(row, col, mobile_col) if mobile_col else None
+        email  = _first(row, email_i)
+        mobile = _first(row, mobile_i)
 
         if not state and gstin:
             state = state_from_gstin(gstin)
@@ -842,15 +996,19 @@ def convert_generic_parties(rows, header_idx):
     return parties
 
 def apply_pincode_lookup(parties, pincode_db):
+    db_get = pincode_db.get
     for p in parties:
         pin = p.get("PIN Code")
-        if pin:
-            entry = pincode_db.get(str(pin).zfill(6))
-            if entry:
-                if not p.get("City"):
-                    p["City"] = entry.get("c") or None
-                if not p.get("State"):
-                    p["State"] = entry.get("s") or None
+        # Nothing to fill when there's no PIN or City and State are both known
+        if not pin or (p.get("City") and p.get("State")):
+            continue
+        pin   = pin if isinstance(pin, str) else str(pin)
+        entry = db_get(pin if len(pin) >= 6 else pin.zfill(6))
+        if entry:
+            if not p.get("City"):
+                p["City"] = entry.get("c") or None
+            if not p.get("State"):
+                p["State"] = entry.get("s") or None
     return parties
 
 def fill_addr2_with_city(parties):
@@ -866,65 +1024,36 @@ def split_network_sheets(parties):
     Sheet 2 (Have GSTIN)             : Not ready but GSTIN present
     Sheet 3 (Need to update manually): everything else, plus bad-pin rows (_bad_pin=True)
     Sheet 4 (Duplicate GSTINs)       : rows whose GSTIN already appears in Sheet 1
+                                       (only written when there are any)
     """
     ready, have_gstin, manual, duplicates = [], [], [], []
     seen_gstins = set()
 
-    temp_ready = []
+    # Single pass: duplicate-GSTIN check happens as each ready row is seen,
+    # which keeps the same first-wins order as a separate second pass
     for p in parties:
         pin       = p.get("PIN Code")
-        pin_valid = bool(pin and len(str(pin)) >= 6)
+        pin_valid = bool(pin) and len(pin if isinstance(pin, str) else str(pin)) >= 6
         has_addr  = bool(p.get("Address Line 1"))
 
         if has_addr and pin_valid:
-            temp_ready.append(p)
+            gstin = p.get("GSTIN")
+            if gstin and gstin in seen_gstins:
+                duplicates.append(p)
+            else:
+                if gstin:
+                    seen_gstins.add(gstin)
+                ready.append(p)
         elif has_addr and pin and not pin_valid:
-            p2 = dict(p)
-            p2["_bad_pin"] = True
-            manual.append(p2)
+            p["_bad_pin"] = True   # flag in place, like the lookup / fill stages
+            manual.append(p)
         elif p.get("GSTIN"):
             have_gstin.append(p)
         else:
             manual.append(p)
 
-    for p in temp_ready:
-        gstin = p.get("GSTIN")
-        if gstin and gstin in seen_gstins:
-            duplicates.append(p)
-        else:
-            if gstin:
-                seen_gstins.add(gstin)
-            ready.append(p)
-
     return ready, have_gstin, manual, duplicates
 
-def make_network_xlsx(ready, have_gstin, manual, duplicates=None):
-    from openpyxl.styles import PatternFill
-    RED_FILL     = PatternFill(start_color="FFCCCC", end_color="FFCCCC", fill_type="solid")
-    PIN_RED_FILL = PatternFill(start_color="FF6666", end_color="FF6666", fill_type="solid")
-    PIN_COL_IDX  = NETWORK_OUT_HEADERS.index("PIN Code") + 1   # 1-indexed
-
-    wb = Workbook()
-    def write_sheet(ws, parties):
-        ws.append(NETWORK_OUT_HEADERS)
-        for p in parties:
-            ws.append([p.get(h) for h in NETWORK_OUT_HEADERS])
-            r = ws.max_row
-            if p.get("_is_red"):
-                for c in range(1, len(NETWORK_OUT_HEADERS) + 1):
-                    ws.cell(row=r, column=c).fill = RED_FILL
-            if p.get("_bad_pin"):
-                ws.cell(row=r, column=PIN_COL_IDX).fill = PIN_RED_FILL
-
-    ws1 = wb.active;  ws1.title = "Ready to upload";      write_sheet(ws1, ready)
-    ws2 = wb.create_sheet("Have GSTIN");                   write_sheet(ws2, have_gstin)
-    ws3 = wb.create_sheet("Need to update manually");      write_sheet(ws3, manual)
-    ws4 = wb.create_sheet("Duplicate GSTINs");             write_sheet(ws4, duplicates or [])
-
-    buf = io.BytesIO()
-    wb.save(buf)
-    return buf.getvalue()
-
 def net_filename(fname):
     m  = re.search(r"\(([^)]+)\)", fname)
     cn = m.group(1) if m else fname.rsplit(".", 1)[0]
@@ -1023,22 +1152,29 @@ BOM_INSTRUCTIONS_ROWS = [
 ]
 
 
+_QTY_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([A-Za-z]*)$')
+
 def parse_qty_unit(value):
     """Parse '1PCS' → (1, 'PCS'), '0.002KGS' → (0.002, 'KGS'), '1' → (1, 'PCS')."""
-    if value is None:
+    if value is None or value == "":
         return 1, "PCS"
+    # Numeric cells skip the str / regex round-trip (bool is excluded: str(True) isn't a qty)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return (int(value) if value == int(value) else value), "PCS"
+        except (ValueError, OverflowError):   # NaN / inf
+            return 1, "PCS"
     s = str(value).strip()
     if not s:
         return 1, "PCS"
-    m = re.match(r'^(\d+(?:\.\d+)?)\s*([A-Za-z]*)$', s)
+    m = _QTY_RE.match(s)
     if m:
         try:
             qty = float(m.group(1))
             qty = int(qty) if qty == int(qty) else qty
         except ValueError:
             qty = 1
-        unit = m.group(2).upper().strip() or "PCS"
-        return qty, unit
+        return qty, m.group(2).upper() or "PCS"
     try:
         qty = float(s)
         return (int(qty) if qty == int(qty) else qty), "PCS"
@@ -1069,6 +1205,16 @@ def _parse_tally_bom_xls(file_bytes):
         if data_start != 6:
             break
 
+    # A sheet only uses a few XF records — resolve each one's (bold, italic) once
+    xf_list, font_list = wb.xf_list, wb.font_list
+    style_cache = {}
+    def style(xfi):
+        r = style_cache.get(xfi)
+        if r is None:
+            font = font_list[xf_list[xfi].font_index]
+            r = style_cache[xfi] = (bool(font.bold), bool(font.italic))
+        return r
+
     fg_rows, rm_rows = [], []
     fg_sl         = 0
     parent        = None
@@ -1084,10 +1230,7 @@ def _parse_tally_bom_xls(file_bytes):
         if not name:
             continue
 
-        xf      = wb.xf_list[cell_part.xf_index]
-        font    = wb.font_list[xf.font_index]
-        bold    = bool(font.bold)
-        italic  = bool(font.italic)
+        bold, italic = style(cell_part.xf_index)
         qty_raw = row[qty_col].value if qty_col < len(row) else None
 
         if bold and not italic:
@@ -1115,6 +1258,23 @@ def _parse_tally_bom_xls(file_bytes):
     return fg_rows, rm_rows
 
 
+def _font_flags_lookup():
+    """
+    Return a cell → (bold, italic) function for read-only openpyxl cells,
+    memoized per fontId: a workbook only has a handful of fonts, so the
+    Font object is only resolved on a cache miss.
+    """
+    cache = {}
+    def font_flags(cell):
+        fid = cell.style_array.fontId
+        r = cache.get(fid)
+        if r is None:
+            font = cell.font
+            r = cache[fid] = (bool(font and font.bold), bool(font and font.italic))
+        return r
+    return font_flags
+
+
 def parse_tally_bom(file_bytes):
     """
     Parse Tally BOM Excel (Item Estimates sheet).
@@ -1135,12 +1295,16 @@ def parse_tally_bom(file_bytes):
     Supports both .xlsx and .xls formats.
     Returns (fg_rows, rm_rows) as lists of dicts.
     """
-    if file_bytes[:4] == b'\xd0\xcf\x11\xe0':   # XLS magic bytes
+    if sniff(file_bytes) == "xls":
         return _parse_tally_bom_xls(file_bytes)
 
     # ── XLSX path (openpyxl) ──────────────────────────────────────────
-    wb = openpyxl.load_workbook(io.BytesIO(file_bytes))
+    # Read-only streams rows instead of building the full DOM; bold/italic come
+    # from the shared font table by fontId, which is all FG/RM needs
+    wb = openpyxl.load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True,
+                                keep_links=False)
     ws = wb["Item Estimates"] if "Item Estimates" in wb.sheetnames else wb.active
+    ws.reset_dimensions()   # don't let a wrong stored <dimension> truncate rows
 
     # ── Auto-detect header row & column positions ─────────────────────
     part_col   = 0   # index of Particulars column (item name)
@@ -1166,8 +1330,11 @@ def parse_tally_bom(file_bytes):
     parent        = None
     rm_seq        = 0
     parent_fg_qty = 1
+    font_flags    = _font_flags_lookup()
 
-    for row in ws.iter_rows(min_row=data_start):
+    # Only Particulars and Qty are read; max_col keeps read-only mode from
+    # building cell objects for the rate/amount columns to their right
+    for row in ws.iter_rows(min_row=data_start, max_col=max(part_col, qty_col) + 1):
         if part_col >= len(row):
             continue
         cell_part = row[part_col]
@@ -1177,8 +1344,7 @@ def parse_tally_bom(file_bytes):
         if not name:
             continue
 
-        bold    = bool(cell_part.font and cell_part.font.bold)
-        italic  = bool(cell_part.font and cell_part.font.italic)
+        bold, italic = font_flags(cell_part)
         qty_raw = cell_qty.value if cell_qty else None
 
         if bold and not italic:
@@ -1206,47 +1372,53 @@ def parse_tally_bom(file_bytes):
                 "Item Description": name, "Quantity": qty, "Unit": unit,
             })
 
+    wb.close()
     return fg_rows, rm_rows
 
 
 def make_bom_xlsx(fg_rows, rm_rows):
     """Produce BulkUpload-format Excel (FG + RM + Scrap + Routing + Other Charges + Instructions)."""
     from openpyxl.styles import PatternFill, Font as XLFont
+    from openpyxl.cell import WriteOnlyCell
     RED_FILL = PatternFill(start_color="FF0000", end_color="FF0000", fill_type="solid")
     RED_FONT = XLFont(color="FFFFFF", bold=True)
 
-    name_count = {}
-    for r in fg_rows:
-        n = r["FG Item Name"]
-        name_count[n] = name_count.get(n, 0) + 1
+    name_count = Counter(r["FG Item Name"] for r in fg_rows)
     duplicates = {n for n, c in name_count.items() if c > 1}
 
-    wb    = Workbook()
+    # Write-only workbook: rows are streamed to XML instead of kept as cell objects
+    wb    = Workbook(write_only=True)
 
     # ── FG sheet ─────────────────────────────────────────────────────────
-    ws_fg = wb.active
-    ws_fg.title = "FG"
+    # Parsers emit fixed-key dicts; one itemgetter call per row pulls every
+    # field positionally instead of a chain of subscripts
+    fg_fields = itemgetter("Sl_No", "FG Item Name", "FG UOM", "BOM Name", "FG Cost Allocation")
+    rm_fields = itemgetter("Sl_No", "#", "Item Description", "Quantity", "Unit")
+
+    ws_fg = wb.create_sheet("FG")
     ws_fg.append(BOM_FG_HEADERS)
     for r in fg_rows:
-        ws_fg.append([
-            r["Sl_No"], None, r["FG Item Name"], r["FG UOM"],
-            None, r["BOM Name"], None, None, None, None,
-            r["FG Cost Allocation"], None, None,
-        ])
-        if r["FG Item Name"] in duplicates:
-            rn = ws_fg.max_row
-            for c in range(1, len(BOM_FG_HEADERS) + 1):
-                ws_fg.cell(row=rn, column=c).fill = RED_FILL
-                ws_fg.cell(row=rn, column=c).font = RED_FONT
+        sl, name, uom, bom_name, alloc = fg_fields(r)
+        vals = [
+            sl, None, name, uom,
+            None, bom_name, None, None, None, None,
+            alloc, None, None,
+        ]
+        if name in duplicates:
+            row = [WriteOnlyCell(ws_fg, value=v) for v in vals]
+            for c in row:
+                c.fill = RED_FILL
+                c.font = RED_FONT
+            ws_fg.append(row)
+        else:
+            ws_fg.append(vals)
 
     # ── RM sheet ─────────────────────────────────────────────────────────
     ws_rm = wb.create_sheet("RM")
     ws_rm.append(BOM_RM_HEADERS)
     for r in rm_rows:
-        ws_rm.append([
-            r["Sl_No"], None, None, r["#"], None,
-            r["Item Description"], r["Quantity"], r["Unit"], None,
-        ])
+        sl, seq, desc, qty, unit = rm_fields(r)
+        ws_rm.append([sl, None, None, seq, None, desc, qty, unit, None])
 
     # ── Scrap sheet ──────────────────────────────────────────────────────
     ws_scrap = wb.create_sheet("Scrap")
@@ -1287,16 +1459,22 @@ def get_bom_preview(file_bytes):
     Shows up to 25 non-empty rows with actual Excel row numbers and column letters.
     Supports xlsx, xls, and csv.
     """
-    is_xlsx = file_bytes[:4] == b'PK\x03\x04'
-    if is_xlsx:
-        wb = openpyxl.load_workbook(io.BytesIO(file_bytes))
+    if sniff(file_bytes) == "xlsx":
+        # Read-only + bounded window: only the first 50 rows × A–Z are parsed
+        wb = openpyxl.load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True,
+                                    keep_links=False)
         ws = wb.active
         rows_with_idx = []
-        for idx, row in enumerate(ws.iter_rows(min_row=1, max_row=50, values_only=True), start=1):
-            if any(v is not None for v in row):
-                rows_with_idx.append((idx, list(row)))
-            if len(rows_with_idx) >= 25:
-                break
+        for idx, row in enumerate(ws.iter_rows(min_row=1, max_row=50, max_col=26,
+                                               values_only=True), start=1):
+            vals = list(row)
+            while vals and vals[-1] is None:   # rows come back padded to max_col
+                vals.pop()
+            if vals:
+                rows_with_idx.append((idx, vals))
+                if len(rows_with_idx) >= 25:
+                    break
+        wb.close()
     else:
         # XLS or CSV — use read_file
         sheets = read_file(file_bytes)
@@ -1304,7 +1482,7 @@ def get_bom_preview(file_bytes):
         all_rows = sheets[sname]
         rows_with_idx = [
             (i + 1, list(r)) for i, r in enumerate(all_rows)
-            if any(v is not None for v in r)
+            if r                                 # read_file returns blank rows as []
         ][:25]
 
     if not rows_with_idx:
@@ -1323,8 +1501,29 @@ def get_bom_preview(file_bytes):
     return "\n".join(lines), display_rows
 
 
+@st.cache_resource(show_spinner=False)
+def _bom_llm_cache():
+    """Process-wide {request_key: response_text} store — survives Streamlit reruns."""
+    return {}
+
+BOM_LLM_CACHE_MAX = 256
+
 def call_gemini_bom(api_key, chat_history, preview_text, fname):
-    """Send chat history to Gemini and return the response text."""
+    """
+    Send chat history to Gemini and return the response text.
+    Responses are cached by (preview, history, file name), so replaying the
+    same conversation over the same file skips the API round-trip.
+    """
+    cache = _bom_llm_cache()
+    key   = hashlib.blake2b(
+        json.dumps({"preview": preview_text, "history": chat_history, "fname": fname},
+                   sort_keys=True).encode(),
+        digest_size=16
+    ).hexdigest()
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
     from google import genai
     from google.genai import types
 
@@ -1391,6 +1590,10 @@ def call_gemini_bom(api_key, chat_history, preview_text, fname):
     for attempt in range(3):
         try:
             response = chat.send_message(chat_history[-1]["content"])
+            if response.text:
+                if len(cache) >= BOM_LLM_CACHE_MAX:
+                    cache.pop(next(iter(cache)))   # drop the oldest entry
+                cache[key] = response.text
             return response.text
         except Exception as e:
             if "503" in str(e) and attempt < 2:
@@ -1399,41 +1602,45 @@ def call_gemini_bom(api_key, chat_history, preview_text, fname):
             raise
 
 
+_JSON_BLOCK_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+_JSON_DECODER  = json.JSONDecoder()
+
 def extract_bom_spec(text):
     """Extract JSON conversion spec from Gemini response text."""
-    import json
     # Try ```json ... ``` block
-    m = re.search(r'```json\s*(.*?)\s*```', text, re.DOTALL)
+    m = _JSON_BLOCK_RE.search(text)
     if m:
         try:
             return json.loads(m.group(1))
         except Exception:
             pass
-    # Try first JSON object in the text
-    m = re.search(r'\{.*\}', text, re.DOTALL)
-    if m:
+    # Try first JSON object in the text — decode forward from each '{' rather
+    # than backtracking a greedy DOTALL regex over the whole reply
+    i = text.find("{")
+    while i != -1:
         try:
-            return json.loads(m.group(0))
-        except Exception:
-            pass
+            obj, _ = _JSON_DECODER.raw_decode(text, i)
+            return obj
+        except ValueError:
+            i = text.find("{", i + 1)
     return None
 
 
-def _to_xlsx_bytes(file_bytes):
-    """If file_bytes is CSV or XLS, convert to in-memory xlsx for openpyxl."""
-    is_xlsx = file_bytes[:4] == b'PK\x03\x04'
-    if is_xlsx:
-        return file_bytes
-    sheets = read_file(file_bytes)
-    sname  = pick_sheet(sheets)
-    rows   = sheets[sname]
-    wb2    = Workbook()
-    ws2    = wb2.active
-    for row in rows:
-        ws2.append([v for v in row])
-    buf = io.BytesIO()
-    wb2.save(buf)
-    return buf.getvalue()
+def _norm_upper_lookup():
+    """
+    Return a cell → stripped upper-case text function. Hierarchy and
+    production-type columns repeat a few labels, so text cells are memoized
+    per raw string and strip/upper only run once per distinct label.
+    """
+    cache = {}
+    def norm_upper(v):
+        if isinstance(v, str):
+            r = cache.get(v)
+            if r is None:
+                r = cache[v] = v.strip().upper()
+            return r
+        return str(v).strip().upper() if v else ""
+    return norm_upper
 
 
 def apply_bom_spec(file_bytes, spec):
@@ -1441,118 +1648,147 @@ def apply_bom_spec(file_bytes, spec):
     Apply a Gemini-generated conversion spec to a BOM file.
     Returns (fg_rows, rm_rows) in the same format as parse_tally_bom.
     """
-    file_bytes = _to_xlsx_bytes(file_bytes)
-    wb = openpyxl.load_workbook(io.BytesIO(file_bytes))
-    ws = wb.active
-
     header_row  = spec.get("header_row", 0)     # 0-indexed → openpyxl row = header_row+1
     item_col    = spec.get("item_name_col", 0)
     qty_col_idx = spec.get("qty_col", 1)
     method      = spec.get("hierarchy_method", "column_value")
     data_start  = header_row + 2                 # first data row in openpyxl (1-indexed)
 
+    # Only the font-based methods need cell objects; the rest stream plain values
+    needs_font = method == "font" or (
+        method == "production_type" and spec.get("fg_identifier", "font") == "font")
+    font_flags = _font_flags_lookup()
+    cell_name  = None
+
+    wb = None
+    if sniff(file_bytes) == "xlsx":
+        wb = openpyxl.load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True,
+                                    keep_links=False)
+        ws = wb.active
+        ws.reset_dimensions()
+        rows = ws.iter_rows(min_row=data_start, values_only=not needs_font)
+    else:
+        # XLS/CSV rows from read_file are used as-is rather than re-encoded
+        # to xlsx and parsed again; they carry no fonts, so nothing is bold
+        sheets     = read_file(file_bytes)
+        rows       = sheets[pick_sheet(sheets)][data_start - 1:]
+        needs_font = False
+        font_flags = lambda _cell: (False, False)
+
+    # Per-method spec values are fixed for the whole sheet; resolve them once
+    norm_upper = _norm_upper_lookup()
+    if method == "column_value":
+        hier_col  = spec.get("hierarchy_col", 0)
+        fg_set    = frozenset(v.upper() for v in spec.get("fg_values", ["FG"]))
+        rm_set    = frozenset(v.upper() for v in spec.get("rm_values", ["RM"]) +
+                                                 spec.get("sfg_values", ["SFG"]))
+    elif method == "level":
+        lv_col    = spec.get("level_col", 0)
+        fg_lvls   = frozenset(str(v) for v in spec.get("fg_levels", ["1"]))
+        rm_lvls   = frozenset(str(v) for v in spec.get("rm_levels", ["2", "3"]))
+        lv_class  = {}      # level text → (is_fg, is_rm); BOMs use only a few levels
+    elif method == "numbering":
+        num_col   = spec.get("number_col", 0)
+    elif method == "production_type":
+        fg_id     = spec.get("fg_identifier", "font")
+        fg_indent = spec.get("fg_indent", 0)
+        hcol      = spec.get("hierarchy_col", 0)
+        fg_set    = frozenset(v.upper() for v in spec.get("fg_values", ["FG"]))
+        pt_col    = spec.get("production_type_col", -1)
+        # production type text → PT_BO / PT_SC; bought-out wins if listed in both
+        PT_BO, PT_SC = 1, 2
+        pt_kind   = {v.upper(): PT_SC for v in spec.get("sub_contract_values", ["SUB CONTRACT"])}
+        pt_kind.update({v.upper(): PT_BO for v in spec.get("bought_out_values", ["BOUGHT OUT"])})
+
     fg_rows, rm_rows = [], []
     fg_sl         = 0
     parent        = None
     rm_seq        = 0
     parent_fg_qty = 1
 
-    for row in ws.iter_rows(min_row=data_start):
+    for row in rows:
         if item_col >= len(row):
             continue
-        cell_name = row[item_col]
-        name = str(cell_name.value).strip() if cell_name.value not in (None, "") else ""
+        if needs_font:
+            cell_name = row[item_col]
+            row = [c.value for c in row]
+        name_val = row[item_col]
+        name = str(name_val).strip() if name_val not in (None, "") else ""
         if not name:
             continue
 
-        cell_qty = row[qty_col_idx] if qty_col_idx < len(row) else None
-        qty_raw  = cell_qty.value if cell_qty else None
+        qty_raw = row[qty_col_idx] if qty_col_idx < len(row) else None
         is_fg = is_rm = False
 
         if method == "column_value":
-            hier_col = spec.get("hierarchy_col", 0)
-            hcell    = row[hier_col] if hier_col < len(row) else None
-            hval     = str(hcell.value).strip().upper() if (hcell and hcell.value) else ""
-            fg_vals  = [v.upper() for v in spec.get("fg_values",  ["FG"])]
-            rm_vals  = [v.upper() for v in spec.get("rm_values",  ["RM"])] + \
-                       [v.upper() for v in spec.get("sfg_values", ["SFG"])]
-            is_fg = hval in fg_vals
-            is_rm = hval in rm_vals
+            hcell = row[hier_col] if hier_col < len(row) else None
+            hval  = norm_upper(hcell)
+            is_fg = hval in fg_set
+            is_rm = hval in rm_set
 
         elif method == "indentation":
             fg_ind = spec.get("fg_indent", 0)
             rm_ind = spec.get("rm_indent", 2)
-            raw    = str(cell_name.value) if cell_name.value else ""
+            raw    = str(name_val)
             leading = len(raw) - len(raw.lstrip())
             is_fg = leading == fg_ind
             is_rm = leading >= rm_ind
 
         elif method == "font":
-            bold   = bool(cell_name.font and cell_name.font.bold)
-            italic = bool(cell_name.font and cell_name.font.italic)
+            bold, italic = font_flags(cell_name)
             is_fg  = bold and not italic
             is_rm  = italic
 
         elif method == "level":
-            lv_col  = spec.get("level_col", 0)
             lv_cell = row[lv_col] if lv_col < len(row) else None
-            lv_val  = str(lv_cell.value).strip() if (lv_cell and lv_cell.value is not None) else ""
-            fg_lvls = [str(v) for v in spec.get("fg_levels", ["1"])]
-            rm_lvls = [str(v) for v in spec.get("rm_levels", ["2", "3"])]
-            try:
-                lv_num = str(int(float(lv_val)))
-            except (ValueError, TypeError):
-                lv_num = lv_val
-            is_fg = lv_num in fg_lvls or lv_val in fg_lvls
-            is_rm = lv_num in rm_lvls or lv_val in rm_lvls
+            lv_val  = str(lv_cell).strip() if lv_cell is not None else ""
+            cls     = lv_class.get(lv_val)
+            if cls is None:
+                try:
+                    lv_num = str(int(float(lv_val)))
+                except (ValueError, TypeError, OverflowError):
+                    lv_num = lv_val
+                cls = lv_class[lv_val] = (lv_num in fg_lvls or lv_val in fg_lvls,
+                                          lv_num in rm_lvls or lv_val in rm_lvls)
+            is_fg, is_rm = cls
 
         elif method == "numbering":
-            num_col  = spec.get("number_col", 0)
             num_cell = row[num_col] if num_col < len(row) else None
-            num_val  = str(num_cell.value).strip() if (num_cell and num_cell.value is not None) else ""
+            num_val  = str(num_cell).strip() if num_cell is not None else ""
             # top-level = single integer like "1", "2" → FG; sub-level has dots "1.1" → RM
-            parts = num_val.split(".")
-            is_fg = len(parts) == 1 and parts[0].isdigit()
-            is_rm = len(parts) > 1
+            is_rm = "." in num_val
+            is_fg = not is_rm and num_val.isdigit()
 
         elif method == "production_type":
             # FG identification uses fg_identifier (font/indent/column_value)
-            fg_id = spec.get("fg_identifier", "font")
             if fg_id == "font":
-                bold  = bool(cell_name.font and cell_name.font.bold)
-                italic = bool(cell_name.font and cell_name.font.italic)
+                bold, italic = font_flags(cell_name)
                 is_fg = bold and not italic
             elif fg_id == "indentation":
-                raw = str(cell_name.value) if cell_name.value else ""
-                is_fg = (len(raw) - len(raw.lstrip())) == spec.get("fg_indent", 0)
+                raw = str(name_val)
+                is_fg = (len(raw) - len(raw.lstrip())) == fg_indent
             elif fg_id == "column_value":
-                hcol  = spec.get("hierarchy_col", 0)
                 hcell = row[hcol] if hcol < len(row) else None
-                hval  = str(hcell.value).strip().upper() if (hcell and hcell.value) else ""
-                is_fg = hval in [v.upper() for v in spec.get("fg_values", ["FG"])]
+                is_fg = norm_upper(hcell) in fg_set
 
             if not is_fg:
-                pt_col  = spec.get("production_type_col", -1)
                 pt_cell = row[pt_col] if (pt_col >= 0 and pt_col < len(row)) else None
-                pt_val  = str(pt_cell.value).strip().upper() if (pt_cell and pt_cell.value) else ""
-                bo_vals  = [v.upper() for v in spec.get("bought_out_values",  ["BOUGHT OUT"])]
-                sc_vals  = [v.upper() for v in spec.get("sub_contract_values", ["SUB CONTRACT"])]
-
-                if pt_val in bo_vals:
+                kind = pt_kind.get(norm_upper(pt_cell))
+                if kind == PT_BO:
                     is_rm = True          # direct RM — purchased as-is
-                elif pt_val in sc_vals:
+                elif kind == PT_SC:
                     # SFG: add as RM under parent FG AND as its own FG entry
+                    sfg_qty, uom = parse_qty_unit(qty_raw)
                     if parent is not None:
                         rm_seq += 1
-                        qty, unit = parse_qty_unit(qty_raw)
+                        qty = sfg_qty
                         if parent_fg_qty and parent_fg_qty > 1:
                             qty = qty / parent_fg_qty
                         rm_rows.append({
                             "Sl_No": parent, "#": rm_seq,
-                            "Item Description": name, "Quantity": qty, "Unit": unit,
+                            "Item Description": name, "Quantity": qty, "Unit": uom,
                         })
                     fg_sl += 1
-                    sfg_qty, uom = parse_qty_unit(qty_raw)
                     fg_rows.append({
                         "Sl_No": fg_sl, "FG Item Name": name,
                         "FG UOM": uom, "BOM Name": name, "FG Cost Allocation": 100,
@@ -1582,6 +1818,8 @@ def apply_bom_spec(file_bytes, spec):
                 "Item Description": name, "Quantity": qty, "Unit": unit,
             })
 
+    if wb is not None:
+        wb.close()
     return fg_rows, rm_rows
 
 
@@ -1606,7 +1844,8 @@ st.set_page_config(
 
 st.markdown("""
 <style>
-@import url('https://fonts.googleapis.com/css2?family=Outfit:wght@400;600;700;900&display=swap');
+/* Outfit is only used for the wordmark and stat numbers: fetch just those glyphs */
+@import url('https://fonts.googleapis.com/css2?family=Outfit:wght@700;900&text=ACNRTZi0123456789&display=swap');
 
 /* ── Logo bar ── */
 .logo-bar {
@@ -1665,6 +1904,8 @@ st.markdown("""
 .map-tgt  { background:#1e1e2a; color:#7e9ecf; border-radius:6px; padding:4px 10px; font-size:0.82rem; }
 .map-arr  { color:#555; font-size:0.9rem; text-align:center; }
 .map-extra{ background:#2a2117; color:#c8a96e; border-radius:6px; padding:3px 9px; font-size:0.78rem; font-family:monospace; display:inline-block; margin:2px; }
+.map-extras { margin-top:10px; }
+.map-lbl  { color:#888; font-size:0.8rem; }
 
 /* ── Network stat cards ── */
 .stat-cards { display:flex; gap:12px; margin:14px 0; }
@@ -1692,6 +1933,10 @@ st.markdown("""
     margin-bottom:10px;
 }
 
+/* ── Template expander body ── */
+.tmpl-body { margin-bottom:14px; }
+.map-fp    { color:#888; font-size:0.8rem; margin-top:10px; }
+
 /* ── Template card ── */
 .tmpl-card {
     background:#141510; border:1px solid #2e2f2b;
@@ -1707,7 +1952,7 @@ button[data-baseweb="tab"] { font-weight: 600 !important; font-size:0.9rem !impo
 """, unsafe_allow_html=True)
 
 # ── Header ──────────────────────────────────────────────────────────────────
-st.markdown("""
+st.html("""
 <div class="logo-bar">
   <svg width="40" height="40" viewBox="0 0 42 42" style="flex-shrink:0">
     <line x1="21" y1="21" x2="4"  y2="38" stroke="#F5A623" stroke-width="9" stroke-linecap="round"/>
@@ -1732,31 +1977,48 @@ st.markdown("""
   <span class="pill">🧩 BOM Upload</span>
   <span class="pill">⚡ Auto-detects any format</span>
 </div>
-""", unsafe_allow_html=True)
+""")
+
+# One source → target row of a mapping preview (Tab 1 and saved templates)
+MAP_ROW_HTML = ('<div class="map-grid"><span class="map-src">{src}</span>'
+                '<span class="map-arr">→</span><span class="map-tgt">{tgt}</span></div>').format
+
+FOOTER_HTML = (
+    '<p style="text-align:center;color:#444;font-size:0.78rem;margin:0;">'
+    'TranZact Ai &nbsp;·&nbsp; Master Data Converter &nbsp;·&nbsp; v3.0 &nbsp;·&nbsp; '
+    'Item Master &nbsp;·&nbsp; Network Master &nbsp;·&nbsp; BOM Upload</p>'
+)
 
 st.divider()
 tab1, tab2, tab3, tab4 = st.tabs(["📦  Item Master", "🏢  Network Master", "🧩  BOM Upload", "🗂  Templates"])
 
+# Each tab is a fragment: its widgets rerun only that tab, not the CSS or the
+# other tabs. Anything that changes another tab's data (saving a template)
+# asks for a full st.rerun().
+
 # ─────────────────────────────────────────────────────────────────────────────
 # TAB 1 : Any client format  →  Product_Add_(X).xlsx
 # ─────────────────────────────────────────────────────────────────────────────
-with tab1:
+@st.fragment
+def item_master_tab():
     st.markdown("Upload any client item file — columns are **auto-detected and mapped** to your format.")
 
     up = st.file_uploader("Upload client file", type=["xlsx", "xls", "csv"], key="t1_up",
                           label_visibility="collapsed")
 
     if up:
-        up.seek(0)
-        fbytes = up.read()
-        fname  = up.name
+        fname = up.name
 
         if st.session_state.get("t1_fname") != fname:
-            sheets     = read_file(fbytes)
-            sname      = pick_item_master_sheet(sheets)
+            # Bytes are only touched for a new upload; reruns use session state
+            fbytes     = up.getvalue()
+            fdigest    = file_digest(fbytes)
+            sheets     = _cached_read_file(fdigest, fbytes)
+            heads      = {n: normalize_head(r) for n, r in sheets.items()}
+            sname      = pick_item_master_sheet(sheets, heads)
             rows       = sheets[sname]
-            hidx, hdrs = detect_header(rows)
-            data_rows  = [r for r in rows[hidx + 1:] if any(v for v in r)]
+            hidx, hdrs = detect_header(rows, heads[sname])
+            data_rows  = list(filter(any, rows[hidx + 1:]))
             templates  = load_templates()
             tmpl_name, tmpl = find_template(hdrs, templates)
 
@@ -1767,6 +2029,7 @@ with tab1:
                 mapping, extra_cols = auto_map(hdrs, data_rows)
 
             st.session_state.t1_fname   = fname
+            st.session_state.t1_digest  = fdigest
             st.session_state.t1_rows    = rows
             st.session_state.t1_hidx    = hidx
             st.session_state.t1_headers = hdrs
@@ -1775,13 +2038,14 @@ with tab1:
             st.session_state.t1_extra   = extra_cols
             st.session_state.t1_out     = None
 
+        fdigest    = st.session_state.t1_digest
         rows       = st.session_state.t1_rows
         hidx       = st.session_state.t1_hidx
         hdrs       = st.session_state.t1_headers
         tname      = st.session_state.t1_tname
         mapping    = st.session_state.t1_mapping
         extra_cols = st.session_state.t1_extra
-        data_rows  = [r for r in rows[hidx + 1:] if any(v for v in r)]
+        data_rows  = list(filter(any, rows[hidx + 1:]))
 
         # ── File info strip ──────────────────────────────────────────────
         col_a, col_b, col_c = st.columns(3)
@@ -1792,21 +2056,20 @@ with tab1:
         # ── Mapping preview ──────────────────────────────────────────────
         with st.expander("🔍  Detected column mapping", expanded=False):
             if mapping:
-                rows_html = ""
-                for tgt, src in mapping.items():
-                    if src:
-                        rows_html += f'<div class="map-grid"><span class="map-src">{src}</span><span class="map-arr">→</span><span class="map-tgt">{tgt}</span></div>'
+                parts = [MAP_ROW_HTML(src=src, tgt=tgt) for tgt, src in mapping.items() if src]
                 if extra_cols:
                     extras_html = "".join(f'<span class="map-extra">{e}</span>' for e in extra_cols[:12])
-                    rows_html += f'<div style="margin-top:10px;"><span style="color:#888;font-size:0.8rem;">Extra columns appended: </span>{extras_html}</div>'
-                st.markdown(rows_html, unsafe_allow_html=True)
+                    parts.append(f'<div class="map-extras"><span class="map-lbl">Extra columns appended: </span>{extras_html}</div>')
+                if parts:
+                    st.html("".join(parts))
             else:
                 st.caption("No mapping detected yet.")
 
         st.markdown("")
         if st.button("▶  Convert Now", type="primary", use_container_width=True, key="t1_go"):
             with st.spinner("Converting…"):
-                result = do_convert(rows, hidx, mapping, extra_cols)
+                result = _cached_do_convert(fdigest, hidx, tuple(mapping.items()),
+                                            tuple(extra_cols), rows)
             if result:
                 st.session_state.t1_out      = make_xlsx(result, extra_cols)
                 st.session_state.t1_out_name = out_filename(fname)
@@ -1845,31 +2108,40 @@ with tab1:
                                 "extra_cols":  extra_cols
                             }
                             save_templates(all_t)
+                            # A save under a name marked for deletion un-marks it
+                            st.session_state.get("tmpl_pending", set()).discard(tname_in.strip())
                             st.session_state.t1_tname = tname_in.strip()
-                            st.success(f"✅  Saved as **{tname_in.strip()}**!")
+                            st.session_state.t1_saved = True
+                            st.rerun()   # full run, so the Templates tab lists it
+            elif st.session_state.pop("t1_saved", False):
+                st.success(f"✅  Saved as **{tname}**!")
+
+with tab1:
+    item_master_tab()
 
 # ─────────────────────────────────────────────────────────────────────────────
 # TAB 2 : Network Master  →  Network_Add_(X).xlsx
 # ─────────────────────────────────────────────────────────────────────────────
-with tab2:
+@st.fragment
+def network_master_tab():
     st.markdown("Upload a client ledger / vendor file — auto-converts to your **Network Add** format.")
 
     net_up = st.file_uploader("Upload client file", type=["xlsx", "xls", "csv"], key="net_up",
                                label_visibility="collapsed")
 
     if net_up:
-        net_up.seek(0)
-        net_bytes = net_up.read()
         net_fname = net_up.name
 
         if st.session_state.get("net_fname") != net_fname:
             try:
-                sheets   = read_file(net_bytes)
+                net_bytes = net_up.getvalue()
+                sheets   = _cached_read_file(file_digest(net_bytes), net_bytes)
+                heads    = {n: normalize_head(r) for n, r in sheets.items()}
 
                 # Per-sheet filter: skip item master sheets, keep network sheets
                 skipped_im, network_sheets = [], {}
                 for sname, srows in sheets.items():
-                    im_flag, im_cols = is_item_master_sheet(srows)
+                    im_flag, im_cols = is_item_master_sheet(srows, heads[sname])
                     if im_flag:
                         skipped_im.append((sname, im_cols))
                     else:
@@ -1885,27 +2157,33 @@ with tab2:
                         f"(detected columns: *{', '.join(sorted(all_cols))}*). "
                         f"Please upload it in the **📦 Item Master** tab instead."
                     )
-                    st.stop()
+                    return
 
                 # Warn about skipped sheets but continue processing
                 if skipped_im:
                     skipped_names = ", ".join(f"**{s}**" for s, _ in skipped_im)
                     st.info(f"ℹ️ Skipped item master sheet(s): {skipped_names} — processing remaining sheets for network data.")
 
+                # Each sheet is classified once; the fallback reuses the result
+                formats  = {sname: detect_network_format(srows, heads[sname])
+                            for sname, srows in network_sheets.items()}
+                counts   = {}   # sheet → non-blank data rows, shared with the fallback
                 detected = []
                 for sname, srows in network_sheets.items():
-                    fmt, hidx = detect_network_format(srows)
+                    fmt, hidx = formats[sname]
                     if fmt != "unknown":
-                        data_cnt = sum(1 for r in srows[hidx + 1:] if any(v for v in r if v))
+                        data_cnt = counts[sname] = sum(map(any, srows[hidx + 1:]))
                         if data_cnt > 0:
                             detected.append({"name": sname, "rows": srows,
                                              "fmt": fmt, "hidx": hidx, "count": data_cnt})
                 # Fallback: nothing auto-detected — try most-likely sheet from network_sheets
                 if not detected:
-                    sname     = _tally_detect_sheet(network_sheets)
+                    sname     = _tally_detect_sheet(network_sheets, heads)
                     srows     = network_sheets[sname]
-                    fmt, hidx = detect_network_format(srows)
-                    data_cnt  = sum(1 for r in srows[hidx + 1:] if any(v for v in r if v))
+                    fmt, hidx = formats[sname]
+                    data_cnt  = counts.get(sname)
+                    if data_cnt is None:
+                        data_cnt = sum(map(any, srows[hidx + 1:]))
                     detected  = [{"name": sname, "rows": srows,
                                   "fmt": fmt, "hidx": hidx, "count": data_cnt}]
                 st.session_state.net_fname    = net_fname
@@ -1913,7 +2191,7 @@ with tab2:
                 st.session_state.net_out      = None
             except Exception as e:
                 st.error(f"❌  Could not read file: {e}")
-                st.stop()
+                return
 
         detected   = st.session_state.net_detected
         fmt_labels = {"tally": "Tally Export", "mshriy": "MSHRIY Format",
@@ -1924,7 +2202,7 @@ with tab2:
             f'<span class="fmt-badge">⚙ {fmt_labels.get(d["fmt"], d["fmt"])} · {d["name"]}</span>'
             for d in detected
         )
-        st.markdown(badges, unsafe_allow_html=True)
+        st.html(badges)
 
         col_a, col_b = st.columns(2)
         col_a.metric("File", net_fname.rsplit(".", 1)[0][:28])
@@ -1963,7 +2241,7 @@ with tab2:
 
         if st.session_state.get("net_out") and st.session_state.get("net_fname") == net_fname:
             r, g, m, d, total = st.session_state.net_counts
-            st.markdown(f"""
+            st.html(f"""
             <div class="stat-cards">
               <div class="stat-card stat-green">
                 <div class="sc-num">{r}</div>
@@ -1983,7 +2261,7 @@ with tab2:
               </div>
             </div>
             <p style="color:#666;font-size:0.78rem;margin:0 0 12px 0;">{total} parties processed total &nbsp;·&nbsp; 🔴 Red rows = non-standard party type — review with client &nbsp;·&nbsp; 🔴 Red PIN cell = incomplete pincode</p>
-            """, unsafe_allow_html=True)
+            """)
 
             st.download_button(
                 "⬇️  Download Network Add File",
@@ -1995,10 +2273,14 @@ with tab2:
                 key="net_dl"
             )
 
+with tab2:
+    network_master_tab()
+
 # ─────────────────────────────────────────────────────────────────────────────
 # TAB 3 : BOM Upload  →  BOM_Upload_(X).xlsx
 # ─────────────────────────────────────────────────────────────────────────────
-with tab3:
+@st.fragment
+def bom_upload_tab():
     st.markdown("Convert client BOM files to the **BulkUpload** format.")
 
     bom_section = st.radio(
@@ -2026,29 +2308,25 @@ with tab3:
             st.warning("⚠️  CSV files don't contain font formatting — FG/RM detection relies on **bold/italic** fonts and won't work. Please upload an **.xlsx** or **.xls** file for best results.")
 
         if bom_up:
-            bom_up.seek(0)
-            bom_bytes = bom_up.read()
+            bom_bytes = bom_up.getvalue()
             bom_fname = bom_up.name
 
             if st.session_state.get("bom_fname") != bom_fname:
                 try:
-                    fg_rows, rm_rows = parse_tally_bom(bom_bytes)
+                    fg_rows, rm_rows = _cached_parse_tally_bom(file_digest(bom_bytes), bom_bytes)
                     st.session_state.bom_fname   = bom_fname
                     st.session_state.bom_fg_rows = fg_rows
                     st.session_state.bom_rm_rows = rm_rows
                     st.session_state.bom_out     = None
                 except Exception as e:
                     st.error(f"❌  Could not parse BOM file: {e}")
-                    st.stop()
+                    return
 
             fg_rows = st.session_state.bom_fg_rows
             rm_rows = st.session_state.bom_rm_rows
 
-            name_cnt = {}
-            for r in fg_rows:
-                n = r["FG Item Name"]
-                name_cnt[n] = name_cnt.get(n, 0) + 1
-            dup_count = sum(1 for c in name_cnt.values() if c > 1)
+            name_cnt  = Counter(r["FG Item Name"] for r in fg_rows)
+            dup_count = sum(c > 1 for c in name_cnt.values())
 
             c1, c2, c3 = st.columns(3)
             c1.metric("FG Items",      len(fg_rows))
@@ -2107,8 +2385,7 @@ with tab3:
             )
 
             if other_up:
-                other_up.seek(0)
-                other_bytes = other_up.read()
+                other_bytes = other_up.getvalue()
                 other_fname = other_up.name
 
                 # Reset state on new file upload
@@ -2201,10 +2478,26 @@ with tab3:
                         )
                         st.rerun()
 
+with tab3:
+    bom_upload_tab()
+
 # ─────────────────────────────────────────────────────────────────────────────
 # TAB 4 : Templates
 # ─────────────────────────────────────────────────────────────────────────────
-with tab4:
+@st.cache_data(show_spinner=False, max_entries=256)
+def template_html(mapping_items, extra_cols, fingerprint):
+    """Expander body for one saved template; keyed by its (hashable) contents."""
+    parts = [MAP_ROW_HTML(src=c, tgt=t) for t, c in mapping_items if c]
+    if extra_cols:
+        extras = "".join(f'<span class="map-extra">{e}</span>' for e in extra_cols[:10])
+        parts.append(f'<div class="map-extras"><span class="map-lbl">Extra: </span>{extras}</div>')
+    if fingerprint:
+        preview = ", ".join(fingerprint[:6]) + ("…" if len(fingerprint) > 6 else "")
+        parts.append(f'<div class="map-fp">Matched by {len(fingerprint)} columns · {preview}</div>')
+    return f'<div class="tmpl-body">{"".join(parts)}</div>' if parts else ""
+
+@st.fragment
+def templates_tab():
     templates = load_templates()
 
     if not templates:
@@ -2216,36 +2509,57 @@ with tab4:
         </div>
         """, unsafe_allow_html=True)
     else:
-        st.markdown(f"**{len(templates)} saved template{'s' if len(templates) != 1 else ''}** — uploaded when a matching client file is detected automatically.")
+        # Deletes are only marked here; the file is written once on Apply
+        pending = st.session_state.setdefault("tmpl_pending", set())
+        pending.intersection_update(templates)   # forget names already gone from disk
+        n_shown = len(templates) - len(pending)
+        st.markdown(f"**{n_shown} saved template{'s' if n_shown != 1 else ''}** — uploaded when a matching client file is detected automatically.")
+        if pending:
+            pc1, pc2, pc3 = st.columns([2, 1, 1])
+            pc1.caption(f"🗑  {len(pending)} marked for deletion: " + ", ".join(sorted(pending)))
+            if pc2.button("Apply", key="tmpl_apply", type="primary", use_container_width=True):
+                for n in pending:
+                    del templates[n]
+                save_templates(templates)
+                pending.clear()
+                st.rerun(scope="fragment")
+            if pc3.button("Undo", key="tmpl_undo", use_container_width=True):
+                pending.clear()
+                st.rerun(scope="fragment")
         st.markdown("")
-        for name, tmpl in list(templates.items()):
+        n_pages = max(1, -(-n_shown // TEMPLATES_PER_PAGE))
+        page    = min(st.session_state.get("tmpl_page", 0), n_pages - 1)
+        start   = page * TEMPLATES_PER_PAGE
+        shown   = ((n, t) for n, t in templates.items() if n not in pending)
+        # Delete-button keys are assigned once per template name for the session
+        del_keys = st.session_state.setdefault("tmpl_del_keys", {})
+        for name, tmpl in islice(shown, start, start + TEMPLATES_PER_PAGE):
             with st.expander(f"📋  {name}"):
-                m  = tmpl.get("mapping", {})
-                ec = tmpl.get("extra_cols", [])
-                fp = tmpl.get("fingerprint", [])
-
-                rows_html = ""
-                for t, c in m.items():
-                    if c:
-                        rows_html += f'<div class="map-grid"><span class="map-src">{c}</span><span class="map-arr">→</span><span class="map-tgt">{t}</span></div>'
-                if ec:
-                    extras = "".join(f'<span class="map-extra">{e}</span>' for e in ec[:10])
-                    rows_html += f'<div style="margin-top:8px;"><span style="color:#888;font-size:0.78rem;">Extra: </span>{extras}</div>'
-                if rows_html:
-                    st.markdown(rows_html, unsafe_allow_html=True)
-                if fp:
-                    preview = ", ".join(fp[:6]) + ("…" if len(fp) > 6 else "")
-                    st.caption(f"Matched by {len(fp)} columns · {preview}")
-                st.markdown("")
-                if st.button(f"🗑  Delete  '{name}'", key=f"del_{name}"):
-                    del templates[name]
-                    save_templates(templates)
-                    st.rerun()
+                body = template_html(tuple(tmpl.get("mapping", {}).items()),
+                                     tuple(tmpl.get("extra_cols", [])),
+                                     tuple(tmpl.get("fingerprint", [])))
+                if body:
+                    st.html(body)
+                key = del_keys.get(name)
+                if key is None:
+                    key = del_keys[name] = f"tmpl_del_{len(del_keys)}"
+                if st.button(f"🗑  Delete  '{name}'", key=key):
+                    pending.add(name)
+                    st.rerun(scope="fragment")
+        if n_pages > 1:
+            nc1, nc2, nc3 = st.columns([1, 2, 1])
+            if nc1.button("←  Prev", key="tmpl_prev", disabled=page == 0,
+                          use_container_width=True):
+                st.session_state.tmpl_page = page - 1
+                st.rerun(scope="fragment")
+            nc2.caption(f"Page {page + 1} of {n_pages}")
+            if nc3.button("Next  →", key="tmpl_next", disabled=page == n_pages - 1,
+                          use_container_width=True):
+                st.session_state.tmpl_page = page + 1
+                st.rerun(scope="fragment")
+
+with tab4:
+    templates_tab()
 
 st.divider()
-st.markdown(
-    '<p style="text-align:center;color:#444;font-size:0.78rem;margin:0;">'
-    'TranZact Ai &nbsp;·&nbsp; Master Data Converter &nbsp;·&nbsp; v3.0 &nbsp;·&nbsp; '
-    'Item Master &nbsp;·&nbsp; Network Master &nbsp;·&nbsp; BOM Upload</p>',
-    unsafe_allow_html=True
-)
+st.html(FOOTER_HTML)
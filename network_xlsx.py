@@ -0,0 +1,76 @@
+"""
+Network Add workbook writer.
+
+Kept out of app.py so the writer can be imported (and tested) without
+running the Streamlit page.
+"""
+import io
+from operator import itemgetter
+
+from pyexcelerate import Workbook, Style, Fill, Color
+from pyexcelerate.Range import Range
+from pyexcelerate.Worksheet import Worksheet
+
+NETWORK_OUT_HEADERS = [
+    "Company Name", "Buyer/Supplier/Both", "Company Reference ID",
+    "TCS Type", "Company Email", "Company Contact Number",
+    "Address Line 1", "Address Line 2", "City", "State", "Country",
+    "PIN Code", "GSTIN", "GSTIN Type",
+    "Contact Person First Name", "Contact Person Last Name", "Contact Person Email"
+]
+
+RED_STYLE     = Style(fill=Fill(background=Color(255, 204, 204)))   # FFCCCC
+PIN_RED_STYLE = Style(fill=Fill(background=Color(255, 102, 102)))   # FF6666
+
+
+class _FilledBlankSheet(Worksheet):
+    """
+    Worksheet that writes a styled blank cell as an empty <c s=".."/>.
+    PyExcelerate's set_cell_style stores blanks as "" and would write them as
+    empty inline strings, which read back as '' instead of an empty cell.
+    """
+    def _Worksheet__get_cell_data(self, cell, x, y, style):
+        if cell == "" and style is not None and hasattr(style, "id"):
+            return '<c r="%s" s="%d"/>' % (Range.coordinate_to_string((x, y)), style.id)
+        return super()._Worksheet__get_cell_data(cell, x, y, style)
+
+
+def make_network_xlsx(ready, have_gstin, manual, duplicates=None):
+    # PyExcelerate writes value-only sheets much faster than openpyxl; styles
+    # are applied afterwards to the few flagged rows only
+    headers     = NETWORK_OUT_HEADERS
+    n_cols      = len(headers)
+    PIN_COL_IDX = headers.index("PIN Code") + 1   # 1-indexed
+    # Converters always emit every output key, so one C-level itemgetter call
+    # builds the whole row; fall back to .get for any hand-built party dict
+    get_vals    = itemgetter(*headers)
+
+    def row_vals(p):
+        try:
+            return get_vals(p)
+        except KeyError:
+            return [p.get(h) for h in headers]
+
+    wb = Workbook()
+    def write_sheet(title, parties):
+        data = [headers]
+        data.extend(map(row_vals, parties))
+        ws = _FilledBlankSheet(title, wb, data)
+        wb.add_sheet(ws)
+        for r, p in enumerate(parties, start=2):   # row 1 = headers
+            if p.get("_is_red"):
+                # Fill the table's cells only; blanks stay empty, just coloured
+                for c in range(1, n_cols + 1):
+                    ws.set_cell_style(r, c, RED_STYLE)
+            if p.get("_bad_pin"):
+                ws.set_cell_style(r, PIN_COL_IDX, PIN_RED_STYLE)
+
+    write_sheet("Ready to upload",         ready)
+    write_sheet("Have GSTIN",              have_gstin)
+    write_sheet("Need to update manually", manual)
+    if duplicates:   # report-only sheet; left out when there is nothing to report
+        write_sheet("Duplicate GSTINs",    duplicates)
+
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
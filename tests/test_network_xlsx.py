@@ -0,0 +1,48 @@
+import io
+import os
+import sys
+
+import openpyxl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from network_xlsx import NETWORK_OUT_HEADERS, make_network_xlsx  # noqa: E402
+
+
+def _party(**kw):
+    p = {h: None for h in NETWORK_OUT_HEADERS}
+    p.update(kw)
+    return p
+
+
+def _rows(xlsx, sheet):
+    ws = openpyxl.load_workbook(io.BytesIO(xlsx))[sheet]
+    return [dict(zip(NETWORK_OUT_HEADERS, r)) for r in ws.iter_rows(min_row=2)]
+
+
+def test_red_row_fills_every_table_cell_and_keeps_blanks_empty():
+    red = _party(**{"Company Name": "Acme", "Buyer/Supplier/Both": "Agent",
+                    "_is_red": True})
+    row = _rows(make_network_xlsx([], [], [red]), "Need to update manually")[0]
+
+    assert len(row) == len(NETWORK_OUT_HEADERS)
+    for h, cell in row.items():
+        assert cell.fill.fgColor.rgb.endswith("FFCCCC"), h
+        assert cell.value == red[h], h        # blanks read back as None, not ''
+
+
+def test_bad_pin_cell_overrides_red_fill():
+    red = _party(**{"Company Name": "Acme", "Address Line 1": "1 Main Rd",
+                    "PIN Code": "1234", "_is_red": True, "_bad_pin": True})
+    row = _rows(make_network_xlsx([], [], [red]), "Need to update manually")[0]
+
+    assert row["PIN Code"].fill.fgColor.rgb.endswith("FF6666")
+    assert row["City"].fill.fgColor.rgb.endswith("FFCCCC")
+    assert row["City"].value is None
+
+
+def test_plain_row_is_unstyled():
+    p = _party(**{"Company Name": "Acme"})
+    row = _rows(make_network_xlsx([p], [], []), "Ready to upload")[0]
+
+    assert row["Company Name"].value == "Acme"
+    assert row["Company Name"].fill.fill_type is None